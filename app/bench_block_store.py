@@ -0,0 +1,134 @@
+"""
+Measures the memory used by a Blockchain holding a long chain, including its wallet and address indexes,
+compared to a plain list of blocks.
+The chain is built in a temporary storage directory and saved every --save-every blocks like a running node does.
+Usage: python bench_block_store.py --blocks 1000000
+"""
+import argparse
+import glob
+import os
+import resource
+import secrets
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from blockchain import Block, Blockchain, BLOCK_CACHE_SIZE, TRANSACTIONS_PER_BLOCK
+
+
+def make_blocks(start, count, addresses=1000):
+    """
+    Blocks moving coins and assets between a fixed set of addresses
+    """
+    wallets = [f"0x{secrets.token_hex(20)}" for _ in range(addresses)]
+    timestamp = time.time()
+    for index in range(start, start + count):
+        data = [
+            {
+                "sender": "0" if n == 0 else wallets[(index + n) % addresses],
+                "receiver": wallets[(index * 7 + n) % addresses],
+                "amount": 0 if n == 0 else 1,
+                # the faucet transaction of each block mints an asset
+                "asset": secrets.token_hex(32) if n == 0 else None,
+                "timestamp": timestamp,
+            }
+            for n in range(TRANSACTIONS_PER_BLOCK)
+        ]
+        # skip hashing, only the shape of the blocks matters here
+        yield Block(index, index, secrets.token_hex(32), data, timestamp)
+        timestamp += 1.0
+
+
+def rss():
+    """
+    :return: Resident memory of the process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # peak instead of current where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def store_chain(blockchain):
+    blockchain.store_chain()
+    # only the latest save is read, older ones would just fill the disk
+    latest_save = Blockchain.get_latest_save()
+    for path in glob.glob("storage/chain_save_files/*"):
+        if path != latest_save:
+            os.remove(path)
+
+
+def build_chain(count, cache_size, save_every):
+    blockchain = Blockchain(cache_size)
+    started = time.perf_counter()
+    for block in make_blocks(len(blockchain.chain), count - len(blockchain.chain)):
+        Blockchain.add_block_to_chain(blockchain.chain, block)
+        blockchain.index_block(block)
+        if block.index % save_every == 0:
+            store_chain(blockchain)
+    store_chain(blockchain)
+
+    return blockchain, time.perf_counter() - started
+
+
+def scan(blocks):
+    started = time.perf_counter()
+    for block in blocks:
+        for data in block.data:
+            data["receiver"]
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chain memory usage")
+    parser.add_argument("--blocks", type=int, default=1000000)
+    parser.add_argument("--cache-size", type=int, default=BLOCK_CACHE_SIZE)
+    parser.add_argument("--save-every", type=int, default=10000, help="blocks between saves of the chain")
+    parser.add_argument("--skip-list", action="store_true", help="only measure the blockchain")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_block_store_")
+    os.makedirs(os.path.join(workdir, "storage", "chain_save_files"))
+    # the chain storage paths are relative to the working directory
+    os.chdir(workdir)
+
+    try:
+        before = rss()
+        blockchain, elapsed = build_chain(args.blocks, args.cache_size, args.save_every)
+        print(f"Blockchain(cache_size={args.cache_size}): {(rss() - before) / 2 ** 20:.1f} MiB resident, "
+              f"{elapsed:.1f}s to add {args.blocks} blocks")
+
+        address = blockchain.latest_block.data[-1]["receiver"]
+        started = time.perf_counter()
+        blockchain.get_wallet(address)
+        blockchain.get_transactions(address)
+        print(f"Blockchain: {(time.perf_counter() - started) * 1000:.1f}ms for get_wallet and get_transactions")
+
+        started = time.perf_counter()
+        for index in range(0, args.blocks, max(args.blocks // 1000, 1)):
+            blockchain.chain[index]
+        print(f"Blockchain: {(time.perf_counter() - started) * 1000:.1f}ms for 1000 cold reads")
+
+        print(f"Blockchain: {scan(blockchain.chain):.2f}s for a full scan (/export_chain)")
+        del blockchain
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not args.skip_list:
+        blocks = []
+        tracemalloc.start()
+        started = time.perf_counter()
+        blocks.extend(make_blocks(0, args.blocks))
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"list: {current / 2 ** 20:.1f} MiB current, {peak / 2 ** 20:.1f} MiB peak, "
+              f"{elapsed:.1f}s to append {args.blocks} blocks")
+        print(f"list: {scan(blocks):.2f}s for a full scan")
+
+
+if __name__ == "__main__":
+    main()
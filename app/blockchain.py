@@ -2,11 +2,25 @@ import time
 import json
 import os
 import glob
+import re
+import threading
+from array import array
+from collections import OrderedDict
 from hashlib import sha256
 
+from chain_index import ChainIndex
+
 DIFFICULTY_START = 2
 DIFFICULTY_INCREASE_STEP = 1000
 TRANSACTIONS_PER_BLOCK = 3
+FAUCET_AMOUNT = 100
+# number of full blocks kept in memory, older block data is read back from disk
+BLOCK_CACHE_SIZE = 10000
+BLOCK_READ_BATCH = 256
+# wallets, asset owners and address blocks, see chain_index.py
+CHAIN_INDEX_PATH = "storage/chain_index.sqlite3"
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
 
 
 class Block:
@@ -49,12 +63,193 @@ class Block:
         return str(self) == str(other)
 
 
+class BlockStore:
+    """
+    List like storage for the chain.
+    Only block headers are kept in memory. Saved blocks are read back from their line in the
+    latest save file, blocks built since the last save stay in memory until the next one,
+    and an LRU cache keeps the most recently used full blocks around.
+    """
+    def __init__(self, cache_size=BLOCK_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.total_data = 0
+        self._length = 0
+
+        # packed headers, one entry per block
+        self._proof_numbers = array("q")
+        self._timestamps = array("d")
+        self._previous_hashes = bytearray()
+        # headers that do not fit the packed arrays (e.g. the genesis block)
+        self._irregular_headers = {}
+
+        # position of the first saved blocks in the save file
+        self._file = None
+        self._starts = array("q")
+        self._lengths = array("l")
+        # blocks that are not in the save file yet
+        self._pending = {}
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return self.iter_range(0, len(self))
+
+    def iter_range(self, start, stop):
+        """
+        Yields the blocks start <= index < stop reading them from disk in batches,
+        iterating does not change which blocks are cached
+        """
+        for batch_start in range(start, stop, BLOCK_READ_BATCH):
+            yield from self._read_range(batch_start, min(batch_start + BLOCK_READ_BATCH, stop))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+
+        with self._lock:
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+                return block
+
+        block = self._read_range(index, index + 1)[0]
+        with self._lock:
+            self._cache_block(block, index)
+        return block
+
+    def __contains__(self, block):
+        index = getattr(block, "index", None)
+        if not isinstance(index, int) or not 0 <= index < len(self):
+            return False
+
+        # Block equality only looks at the header
+        return self._header_block(index) == block
+
+    def append(self, block, location=None):
+        """
+        :param location: (offset, length) of the block in the save file given to use_save,
+            None for a block that is not saved yet
+        """
+        with self._lock:
+            index = self._length
+            if (
+                block.index == index
+                and isinstance(block.proof_number, int)
+                and 0 <= block.proof_number < 2 ** 63
+                and isinstance(block.timestamp, float)
+                and isinstance(block.previous_hash, str)
+                and HASH_PATTERN.match(block.previous_hash)
+            ):
+                self._proof_numbers.append(block.proof_number)
+                self._timestamps.append(block.timestamp)
+                self._previous_hashes += bytes.fromhex(block.previous_hash)
+            else:
+                self._irregular_headers[index] = (block.index, block.proof_number, block.previous_hash, block.timestamp)
+                self._proof_numbers.append(0)
+                self._timestamps.append(0.0)
+                self._previous_hashes += bytes(32)
+
+            if location is not None and index == len(self._starts):
+                self._starts.append(location[0])
+                self._lengths.append(location[1])
+            else:
+                self._pending[index] = block
+
+            self.total_data += len(block.data)
+            self._cache_block(block, index)
+            # the block only becomes visible once everything is recorded
+            self._length += 1
+
+    def use_save(self, path, starts=None, lengths=None):
+        """
+        Reads saved blocks from path from now on
+        :param starts: Offsets of the first blocks of the chain in the save file
+        :param lengths: Lengths of those blocks
+        """
+        f = open(path, "rb")
+        with self._lock:
+            if starts is not None and len(starts) < len(self._starts):
+                # an older save than the one in use
+                f.close()
+                return
+
+            if self._file is not None:
+                self._file.close()
+
+            self._file = f
+            self._starts = starts if starts is not None else array("q")
+            self._lengths = lengths if lengths is not None else array("l")
+            for index in [index for index in self._pending if index < len(self._starts)]:
+                del self._pending[index]
+
+    def _cache_block(self, block, index):
+        """
+        Must be called holding self._lock
+        """
+        if self.cache_size <= 0:
+            return
+
+        self._cache[index] = block
+        self._cache.move_to_end(index)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _header(self, index):
+        if index in self._irregular_headers:
+            return self._irregular_headers[index]
+
+        previous_hash = self._previous_hashes[index * 32:(index + 1) * 32].hex()
+        return index, self._proof_numbers[index], previous_hash, self._timestamps[index]
+
+    def _header_block(self, index):
+        block_index, proof_number, previous_hash, timestamp = self._header(index)
+        return Block(block_index, proof_number, previous_hash, None, timestamp)
+
+    def _read_range(self, start, stop):
+        """
+        Reads the blocks start <= index < stop, saved blocks that are not cached are read with a single read
+        """
+        with self._lock:
+            # the cache is shared between request threads, only touch it under the lock
+            blocks = [self._cache.get(index) or self._pending.get(index) for index in range(start, stop)]
+            missing = [
+                (position, self._starts[index], self._lengths[index])
+                for position, index in enumerate(range(start, stop))
+                if blocks[position] is None
+            ]
+            if not missing:
+                return blocks
+
+            begin = missing[0][1]
+            self._file.seek(begin)
+            raw = self._file.read(missing[-1][1] + missing[-1][2] - begin)
+
+        for position, offset, length in missing:
+            line = raw[offset - begin:offset - begin + length]
+            blocks[position] = Block(**json.loads(json.loads(line)))
+
+        return blocks
+
+
 class Blockchain:
     difficulty = DIFFICULTY_START
 
-    def __init__(self):
+    def __init__(self, cache_size=BLOCK_CACHE_SIZE):
+        self.cache_size = cache_size
         # stores all blocks
-        self.chain = []
+        self.chain = BlockStore(cache_size)
+        # wallets, asset owners and address blocks, so lookups do not need a chain scan
+        self.index = ChainIndex(CHAIN_INDEX_PATH)
+        self._store_lock = threading.Lock()
         # stores all data about block to be created
         self.current_data = []
 
@@ -62,38 +257,65 @@ class Blockchain:
         if self.load_stored_chain():
             return
 
+        # drop whatever was indexed for an older chain
+        self.index.sync(self.chain)
         self.build_genesis()
 
     def load_stored_chain(self):
         # drop everything in current_data
         self.current_data = []
 
-        chain = self.get_latest_stored_chain()
+        chain = self.get_latest_stored_chain(self.cache_size)
         if chain is None:
             return False
 
+        self.index.sync(chain)
         self.chain = chain
+
         return True
 
     def store_chain(self):
-        latest_chain = self.get_latest_stored_chain() or []
-
-        # check latest save file contains the chain we are saving
-        # avoid tampering
-        if not all(block in self.chain for block in latest_chain):
-            return False
-
-        serialized_chain = [block.to_json() for block in self.chain]
-
-        with open(f"storage/chain_save_files/chain_{int(time.time())}.json", "w+") as f:
-            json.dump(serialized_chain, f)
-
-        return True
+        # saves from concurrent requests would write the same file
+        with self._store_lock:
+            latest_save = self.get_latest_save()
+
+            # check latest save file contains the chain we are saving
+            # avoid tampering
+            if latest_save is not None:
+                try:
+                    if not all(block in self.chain for block, _ in self.iter_stored_chain(latest_save)):
+                        return False
+                except ValueError:
+                    # an invalid save is ignored, same as if there was none
+                    pass
+
+            # one block per line so the save can be read back without loading it whole,
+            # written aside and moved in place so readers of an older save are never disturbed
+            path = f"storage/chain_save_files/chain_{int(time.time())}.json"
+            tmp_path = f"storage/chain_save_files/.{os.path.basename(path)}.tmp"
+            starts = array("q")
+            lengths = array("l")
+            with open(tmp_path, "wb") as f:
+                f.write(b"[\n")
+                for index, block in enumerate(self.chain):
+                    if index:
+                        f.write(b",\n")
+                    line = json.dumps(block.to_json()).encode("utf-8")
+                    starts.append(f.tell())
+                    lengths.append(len(line))
+                    f.write(line)
+                f.write(b"\n]")
+            # saved blocks are read back from the new save from now on, opened before the move
+            # so the store keeps reading the file written here
+            self.chain.use_save(tmp_path, starts, lengths)
+            os.replace(tmp_path, path)
+
+            return True
 
     def build_genesis(self):
         self.build_block(initial=True)
 
-    def build_block(self, initial=False):
+    def build_block(self, initial=False, store=True):
 
         if initial:
             proof_number = 0
@@ -113,9 +335,36 @@ class Blockchain:
         self.current_data = []
 
         Blockchain.add_block_to_chain(self.chain, block)
-        self.store_chain()
+        self.index_block(block)
+        if store:
+            self.store_chain()
         return block
 
+    def grant_faucet(self, addresses, amount=FAUCET_AMOUNT):
+        """
+        Sends coins from the faucet to many new addresses, packing the grants into as few blocks as possible
+        and saving the chain only once
+        :param addresses: Iterable of addresses
+        :return: List of the blocks built
+        """
+        blocks = []
+        for address in addresses:
+            self.current_data.append({
+                "sender": "0",
+                "receiver": address,
+                "amount": amount,
+                "asset": None,
+                "timestamp": time.time(),
+            })
+            if len(self.current_data) >= TRANSACTIONS_PER_BLOCK:
+                blocks.append(self.build_block(store=False))
+
+        if self.current_data:
+            blocks.append(self.build_block(store=False))
+
+        self.store_chain()
+        return blocks
+
     def new_transaction(self, transaction):
         """
         :param transaction: Dict: {
@@ -133,7 +382,7 @@ class Blockchain:
         if (
             not sender
             or not receiver
-            or sender not in self.all_addresses
+            or not self.has_address(sender)
             or sender == receiver
             or (not amount and not asset)
         ):
@@ -178,40 +427,31 @@ class Blockchain:
 
     @property
     def all_addresses(self):
-        addresses = set("0")
+        return set(self.index.addresses()) | {"0"}
 
-        for block in self.chain:
-            for data in block.data:
-                addresses.add(data.get("sender"))
-                addresses.add(data.get("receiver"))
+    def has_address(self, address):
+        # "0" is the faucet, it is always valid but never listed
+        return address == "0" or self.index.has_address(address)
 
-        return addresses
-
-    @property
-    def all_assets(self):
-        assets = set()
-
-        for block in self.chain:
-            for data in block.data:
-                if data.get("asset"):
-                    assets.add(data.get("asset"))
-
-        return assets
+    def index_block(self, block):
+        """
+        Updates the chain index with the transactions of a new block
+        """
+        self.index.add_block(block)
 
     @property
     def total_transactions(self):
-        count = 0
-
-        for block in self.chain:
-            count += len(block.data)
-
-        return count
+        return self.chain.total_data
 
     @staticmethod
     def add_block_to_chain(chain, block):
-        Blockchain.difficulty = DIFFICULTY_START + len(chain) // DIFFICULTY_INCREASE_STEP
+        Blockchain.update_difficulty(len(chain))
         chain.append(block)
 
+    @staticmethod
+    def update_difficulty(length):
+        Blockchain.difficulty = DIFFICULTY_START + length // DIFFICULTY_INCREASE_STEP
+
     @staticmethod
     def confirm_validity(block, previous_block):
         if (
@@ -241,34 +481,85 @@ class Blockchain:
         return guess_hash[:Blockchain.difficulty] == "0" * Blockchain.difficulty
 
     @staticmethod
-    def get_latest_stored_chain():
-        chain = []
+    def get_latest_save():
         list_of_saves = list(glob.iglob("storage/chain_save_files/*"))
 
         if not list_of_saves:
             return None
 
-        latest_save = max(list_of_saves, key=lambda x: int(x[:-5].split("_")[-1]))
+        return max(list_of_saves, key=lambda x: int(x[:-5].split("_")[-1]))
+
+    @staticmethod
+    def iter_stored_blocks(path):
+        """
+        Lazily reads the blocks of a save file
+        :return: Generator of (block, location), location is the (offset, length) of the block
+            in the file or None for older saves
+        """
+        with open(path, "rb") as f:
+            first_line = f.readline()
+
+            if first_line.strip() != b"[":
+                # older saves hold the whole list on a single line
+                f.seek(0)
+                for block_str in json.load(f):
+                    yield Block(**json.loads(block_str)), None
+                return
+
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+
+                line = line.rstrip()
+                if line.endswith(b","):
+                    line = line[:-1]
+                if line and line != b"]":
+                    yield Block(**json.loads(json.loads(line))), (offset, len(line))
+
+    @staticmethod
+    def iter_stored_chain(path):
+        """
+        Lazily reads and validates the blocks of a save file
+        :return: Generator of (block, location), see iter_stored_blocks
+        :raise ValueError: when the stored chain is not valid
+        """
+        previous_block = None
+        for index, (block, location) in enumerate(Blockchain.iter_stored_blocks(path)):
+            if block.previous_hash:
+                if not Blockchain.confirm_validity(block, previous_block):
+                    raise ValueError(f"Invalid block {block.index} in {path}")
+
+            Blockchain.update_difficulty(index)
+            yield block, location
+            previous_block = block
 
-        with open(latest_save, "r") as f:
-            serialized_chain = json.load(f)
-            for block_str in serialized_chain:
-                block = Block(**json.loads(block_str))
-                if block.previous_hash:
-                    if not Blockchain.confirm_validity(block, chain[-1]):
-                        return None
+    @staticmethod
+    def get_latest_stored_chain(cache_size=BLOCK_CACHE_SIZE):
+        chain = BlockStore(cache_size)
+        latest_save = Blockchain.get_latest_save()
 
-                Blockchain.add_block_to_chain(chain, block)
+        if latest_save is None:
+            return None
+
+        chain.use_save(latest_save)
+        try:
+            for block, location in Blockchain.iter_stored_chain(latest_save):
+                chain.append(block, location)
+        except ValueError:
+            return None
 
         return chain
 
     def get_transactions(self, address):
         transactions = []
-        if address not in self.all_addresses:
+        if not self.has_address(address):
             return None
 
-        for block in self.chain:
-            for data in block.data:
+        # only read the blocks the address appears in
+        for index in self.index.get_blocks(address):
+            for data in self.chain[index].data:
                 if address == data["sender"] or address == data["receiver"]:
                     trans = {**data, "timestamp": int(data["timestamp"]) * 1000}
                     transactions.append(trans)
@@ -276,48 +567,40 @@ class Blockchain:
         return transactions
 
     def get_wallet(self, address):
-        coin_amount = 0
-        assets = set()
-
-        if address not in self.all_addresses:
+        if not self.has_address(address):
             return None
 
-        for block in self.chain:
-            for data in block.data:
-                if address == data["sender"]:
-                    coin_amount -= data["amount"]
-                    if data.get("asset"):
-                        assets.remove(data.get("asset"))
+        return self.index.get_wallet(address) or (0, set())
 
-                elif address == data["receiver"]:
-                    coin_amount += data["amount"]
-                    if data.get("asset"):
-                        assets.add(data.get("asset"))
+    def iter_blocks(self, start=0, stop=None):
+        """
+        Lazily yields the blocks with start <= index < stop
+        """
+        # keep a reference so a reload in between does not mix two chains
+        chain = self.chain
+        if stop is None or stop > len(chain):
+            stop = len(chain)
 
-        return coin_amount, assets
+        yield from chain.iter_range(max(start, 0), stop)
 
     def get_blocks(self, start=0, count=None):
-        blocks = []
         if count is None:
             count = len(self.chain)
 
         if start >= len(self.chain) or count > len(self.chain) - start:
             return None
 
-        c = 1
-
-        for index, block in enumerate(self.chain):
-
-            if index >= start and c <= count:
-                blocks.append(block.to_dict())
-                c += 1
+        return [block.to_dict() for block in self.iter_blocks(start, start + count)]
 
-        return blocks
+    def get_assets_info(self, tokens, created_from=None, created_to=None):
+        """
+        Looks up several assets in the chain index
+        :param tokens: Iterable of asset tokens
+        :param created_from: Only assets minted at or after this timestamp_ms
+        :param created_to: Only assets minted at or before this timestamp_ms
+        :return: Dict: {token: {owner: "", created: timestamp_ms}} for the matching assets found in the chain
+        """
+        return self.index.get_assets(tokens, created_from, created_to)
 
     def get_owner(self, token):
-        for block in self.chain:
-            for data in block.data:
-                if token == data["asset"]:
-                    return data["receiver"]
-
-        return None
+        return self.index.get_owner(token)
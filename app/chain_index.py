@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+
+# tokens per query, below the default limit of sqlite variables
+QUERY_BATCH = 500
+# blocks per transaction when rebuilding the index
+REBUILD_BATCH = 10000
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS wallets (
+        id INTEGER PRIMARY KEY,
+        address TEXT NOT NULL UNIQUE,
+        amount NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS assets (
+        token TEXT PRIMARY KEY,
+        owner INTEGER NOT NULL,
+        created INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_assets_owner ON assets (owner)",
+    """
+    CREATE TABLE IF NOT EXISTS address_blocks (
+        wallet INTEGER NOT NULL,
+        block INTEGER NOT NULL,
+        PRIMARY KEY (wallet, block)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        height INTEGER NOT NULL,
+        tip TEXT
+    )
+    """,
+)
+
+
+class ChainIndex:
+    """
+    Wallet balances, asset owners and the blocks each address appears in, kept in a SQLite file
+    so they do not grow the memory of the node with the chain.
+    The index can always be rebuilt from the chain, it remembers which chain it was built for
+    """
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # transactions are handled explicitly, one connection shared by the request threads
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            # a crash only costs a rebuild, no need to wait for the disk
+            self._connection.execute("PRAGMA synchronous = OFF")
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+
+    def sync(self, chain):
+        """
+        Makes the index match chain, what was indexed before is reused when it was built for the same chain
+        """
+        tip = chain[-1].compute_hash if len(chain) else None
+        with self._lock:
+            row = self._connection.execute("SELECT height, tip FROM meta").fetchone()
+        if row == (len(chain), tip):
+            return
+
+        self.rebuild(chain)
+
+    def rebuild(self, chain):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                for table in ("wallets", "assets", "address_blocks", "meta"):
+                    self._connection.execute(f"DELETE FROM {table}")
+
+                for block in chain:
+                    self._add_block(block)
+                    if block.index % REBUILD_BATCH == REBUILD_BATCH - 1:
+                        self._set_tip(block)
+                        self._connection.execute("COMMIT")
+                        self._connection.execute("BEGIN")
+
+                if len(chain):
+                    self._set_tip(chain[-1])
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def add_block(self, block):
+        """
+        Indexes the transactions of a new block
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._add_block(block)
+                self._set_tip(block)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def addresses(self):
+        """
+        :return: Every address of the chain except the faucet
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT address FROM wallets WHERE address != '0'").fetchall()
+
+        return [address for address, in rows]
+
+    def has_address(self, address):
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM wallets WHERE address = ?", (address,)).fetchone()
+
+        return row is not None
+
+    @staticmethod
+    def _address_range(prefix):
+        """
+        :return: (conditions, params) selecting the addresses starting with prefix, the faucet is never listed
+        """
+        if not prefix:
+            return "address != '0'", ()
+
+        # the unique index on address keeps them sorted, a prefix is a range of it
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return "address != '0' AND address >= ? AND address < ?", (prefix, upper)
+
+    def count_addresses(self, prefix=""):
+        conditions, params = self._address_range(prefix)
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM wallets WHERE {conditions}", params).fetchone()[0]
+
+    def page_addresses(self, after=None, limit=100, prefix=""):
+        """
+        :param after: Cursor, the last address of the previous page
+        :param limit: Maximum number of addresses returned
+        :param prefix: Only return addresses starting with it
+        :return: (addresses, next_cursor), next_cursor is None on the last page
+        """
+        conditions, params = self._address_range(prefix)
+        if after is not None:
+            conditions += " AND address > ?"
+            params += (after,)
+
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT address FROM wallets WHERE {conditions} ORDER BY address LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+
+        addresses = [address for address, in rows[:limit]]
+        next_cursor = addresses[-1] if len(rows) > limit else None
+        return addresses, next_cursor
+
+    def get_wallet(self, address):
+        """
+        :return: (coin_amount, assets) or None for an address that is not in the chain
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT id, amount FROM wallets WHERE address = ?", (address,)).fetchone()
+            if row is None:
+                return None
+
+            wallet, amount = row
+            tokens = self._connection.execute("SELECT token FROM assets WHERE owner = ?", (wallet,)).fetchall()
+
+        return amount, {token for token, in tokens}
+
+    def get_blocks(self, address):
+        """
+        :return: Sorted indexes of the blocks with transactions of the address
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT block FROM address_blocks"
+                " WHERE wallet = (SELECT id FROM wallets WHERE address = ?) ORDER BY block",
+                (address,),
+            ).fetchall()
+
+        return [block for block, in rows]
+
+    def get_owner(self, token):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT address FROM assets JOIN wallets ON wallets.id = assets.owner WHERE token = ?",
+                (token,),
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def get_assets(self, tokens, created_from=None, created_to=None):
+        """
+        :param tokens: Iterable of asset tokens
+        :param created_from: Only assets minted at or after this timestamp_ms
+        :param created_to: Only assets minted at or before this timestamp_ms
+        :return: Dict: {token: {owner: "", created: timestamp_ms}} for the matching assets minted by the faucet
+        """
+        tokens = list(set(tokens))
+        conditions = ""
+        bounds = []
+        if created_from is not None:
+            conditions += " AND created >= ?"
+            bounds.append(created_from)
+        if created_to is not None:
+            conditions += " AND created <= ?"
+            bounds.append(created_to)
+
+        info = {}
+        for start in range(0, len(tokens), QUERY_BATCH):
+            batch = tokens[start:start + QUERY_BATCH]
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT token, address, created FROM assets JOIN wallets ON wallets.id = assets.owner"
+                    f" WHERE token IN ({', '.join('?' * len(batch))}) AND created IS NOT NULL{conditions}",
+                    (*batch, *bounds),
+                ).fetchall()
+
+            for token, owner, created in rows:
+                info[token] = {"owner": owner, "created": created}
+
+        return info
+
+    def _wallet_id(self, address):
+        self._connection.execute("INSERT OR IGNORE INTO wallets (address) VALUES (?)", (address,))
+        return self._connection.execute("SELECT id FROM wallets WHERE address = ?", (address,)).fetchone()[0]
+
+    def _add_block(self, block):
+        """
+        Must be called holding self._lock inside a transaction
+        """
+        for data in block.data:
+            sender = self._wallet_id(data["sender"])
+            receiver = self._wallet_id(data["receiver"])
+            self._connection.execute("UPDATE wallets SET amount = amount - ? WHERE id = ?", (data["amount"], sender))
+            self._connection.execute("UPDATE wallets SET amount = amount + ? WHERE id = ?", (data["amount"], receiver))
+
+            if data.get("asset"):
+                # assets come into existence from the faucet, transfers move them to the receiver
+                created = int(data["timestamp"]) * 1000 if data["sender"] == "0" else None
+                self._connection.execute(
+                    "INSERT INTO assets (token, owner, created) VALUES (?, ?, ?)"
+                    " ON CONFLICT (token) DO UPDATE SET owner = excluded.owner",
+                    (data["asset"], receiver, created),
+                )
+
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO address_blocks (wallet, block) VALUES (?, ?)",
+                ((sender, block.index), (receiver, block.index)),
+            )
+
+    def _set_tip(self, block):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (id, height, tip) VALUES (0, ?, ?)",
+            (block.index + 1, block.compute_hash),
+        )
@@ -0,0 +1,112 @@
+"""
+Streams the chain as NDJSON, one block or transaction per line, optionally gzipped.
+Usage: python export_chain.py --kind transactions --start 0 --stop 1000 --gzip -o export.ndjson.gz
+"""
+import argparse
+import json
+import sys
+import zlib
+from itertools import islice
+
+from blockchain import Blockchain
+
+EXPORT_KINDS = ("blocks", "transactions")
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_records(blocks, kind="blocks", offset=0):
+    """
+    :param blocks: Iterable of the blocks to export, e.g. Blockchain.iter_blocks(start, stop)
+    :param kind: "blocks" or "transactions"
+    :param offset: Number of records to skip, used to resume an interrupted export
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"Unknown export kind: {kind}")
+
+    skipped = 0
+    for block in blocks:
+        if kind == "blocks":
+            records = [block]
+        else:
+            records = block.data
+
+        for record in records:
+            if skipped < offset:
+                skipped += 1
+                continue
+
+            if kind == "blocks":
+                # raw fields as stored on disk so another node can verify and load them
+                yield {**block.__dict__, "current_hash": block.compute_hash}
+            else:
+                yield {**record, "block": block.index}
+
+
+def iter_ndjson(records):
+    buffer = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, sort_keys=True) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def export_chain(blocks, kind="blocks", offset=0, compress=False):
+    chunks = iter_ndjson(iter_records(blocks, kind, offset))
+    if compress:
+        return iter_gzip(chunks)
+
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the stored chain as NDJSON")
+    parser.add_argument("--kind", choices=EXPORT_KINDS, default="blocks")
+    parser.add_argument("--start", type=int, default=0, help="first block height")
+    parser.add_argument("--stop", type=int, default=None, help="block height to stop at (excluded)")
+    parser.add_argument("--offset", type=int, default=0, help="records to skip, to resume an export")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser.add_argument("-o", "--output", default="-", help="output file, - for stdout")
+    args = parser.parse_args()
+
+    # read the latest save directly, loading a Blockchain would build and save a genesis block when there is none
+    latest_save = Blockchain.get_latest_save()
+    if latest_save is None:
+        sys.exit("No saved chain found in storage/chain_save_files")
+
+    stored_blocks = islice(Blockchain.iter_stored_chain(latest_save), max(args.start, 0), args.stop)
+    chunks = export_chain((block for block, _ in stored_blocks), args.kind, args.offset, args.gzip)
+
+    try:
+        if args.output == "-":
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+        else:
+            with open(args.output, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import base64
+import binascii
+import os
+import re
+import tempfile
+from hashlib import sha256
+
+DATA_URL_PATTERN = re.compile(r"^data:(?P<mimetype>[\w.+-]+/[\w.+-]+)?(?P<params>(;[^;,]*)*?);base64,(?P<payload>.*)$", re.S)
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+DEFAULT_MIMETYPE = "text/plain"
+
+
+class ImageStore:
+    """
+    Content addressed storage for NFT images, blobs are kept on disk keyed by their sha256
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    @staticmethod
+    def decode(image_str):
+        """
+        :param image_str: String sent by the client, usually a base64 data url
+        :return: (raw_bytes, mimetype)
+        """
+        match = DATA_URL_PATTERN.match(image_str)
+        if match:
+            try:
+                payload = base64.b64decode(match.group("payload"), validate=True)
+                return payload, match.group("mimetype") or "application/octet-stream"
+            except binascii.Error:
+                pass
+
+        return image_str.encode("utf-8"), DEFAULT_MIMETYPE
+
+    @staticmethod
+    def is_digest(value):
+        return bool(value) and DIGEST_PATTERN.match(value) is not None
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, image_str):
+        """
+        Writes the image if it is not stored yet
+        :return: (digest, mimetype)
+        """
+        content, mimetype = ImageStore.decode(image_str)
+        digest = sha256(content).hexdigest()
+
+        path = self.path(digest)
+        if os.path.isfile(path):
+            return digest, mimetype
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # write to a temp file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return digest, mimetype
@@ -0,0 +1,242 @@
+"""
+Load testing harness for the API.
+By default the app is started in-process on 127.0.0.1:5000 with a throwaway SQLite database and chain storage,
+so it runs fully offline. Use --url to drive a node that is already running on localhost instead.
+
+Usage: python load_test.py --users 20 --duration 60 --mix get_wallet=30,make_transaction=20,signup=5
+"""
+import argparse
+import base64
+import logging
+import os
+import random
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+DEFAULT_MIX = "signup=5,make_transaction=25,get_wallet=25,list_transactions=20,get_blocks=15,create_asset=10"
+PASSWORD = "load_test_password"
+
+
+class Recorder:
+    """
+    Collects request latencies per endpoint, both for the current report window and the whole run
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.window = defaultdict(list)
+        self.total = defaultdict(list)
+        self.window_errors = defaultdict(int)
+        self.total_errors = defaultdict(int)
+        self.window_started = time.perf_counter()
+        self.started = self.window_started
+
+    def record(self, endpoint, latency, ok):
+        with self.lock:
+            self.window[endpoint].append(latency)
+            self.total[endpoint].append(latency)
+            if not ok:
+                self.window_errors[endpoint] += 1
+                self.total_errors[endpoint] += 1
+
+    def flush_window(self):
+        with self.lock:
+            window, errors = self.window, self.window_errors
+            elapsed = time.perf_counter() - self.window_started
+            self.window = defaultdict(list)
+            self.window_errors = defaultdict(int)
+            self.window_started = time.perf_counter()
+
+        return window, errors, elapsed
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, base_url, mix, recorder, addresses, deadline):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.endpoints = list(mix)
+        self.weights = [mix[endpoint] for endpoint in self.endpoints]
+        self.recorder = recorder
+        self.addresses = addresses
+        self.deadline = deadline
+        self.session = requests.Session()
+        self.address = None
+
+    def call(self, endpoint, method, path, payload=None, session=None):
+        session = session or self.session
+        started = time.perf_counter()
+        try:
+            response = session.request(method, f"{self.base_url}{path}", json=payload, timeout=60)
+            ok = response.status_code == 200
+            body = response.json() if ok else None
+            # the api reports most failures in the body of a 200 response
+            if isinstance(body, dict) and (body.get("success") is False or body.get("status", 200) != 200):
+                ok = False
+        except (requests.RequestException, ValueError):
+            ok, body = False, None
+
+        self.recorder.record(endpoint, time.perf_counter() - started, ok)
+        return body
+
+    def signup(self, session=None):
+        payload = {
+            "email": f"load_{secrets.token_hex(8)}@example.com",
+            "password": PASSWORD,
+        }
+        body = self.call("signup", "POST", "/signup", payload, session)
+        if body and body.get("address"):
+            self.addresses.append(body["address"])
+        return body
+
+    def run(self):
+        body = self.signup()
+        if not body or not body.get("api_key"):
+            return
+
+        self.address = body["address"]
+        self.session.headers["Authorization"] = f"Bearer {body['api_key']}"
+
+        while time.monotonic() < self.deadline:
+            endpoint = random.choices(self.endpoints, self.weights)[0]
+            getattr(self, f"do_{endpoint}")()
+
+    def do_signup(self):
+        # a fresh session so this user stays logged in as itself
+        self.signup(requests.Session())
+
+    def do_make_transaction(self):
+        receiver = random.choice(self.addresses)
+        if receiver == self.address:
+            return
+        self.call("make_transaction", "POST", "/make_transaction", {"receiver": receiver, "amount": 1})
+
+    def do_get_wallet(self):
+        self.call("get_wallet", "POST", "/get_wallet", {})
+
+    def do_list_transactions(self):
+        self.call("list_transactions", "POST", "/list_transactions", {"address": self.address})
+
+    def do_get_blocks(self):
+        self.call("get_blocks", "POST", "/get_blocks", {"page_id": 0})
+
+    def do_create_asset(self):
+        image = f"data:image/png;base64,{str(base64.b64encode(secrets.token_bytes(256)), 'utf-8')}"
+        self.call("create_asset", "POST", "/create_asset", {"image": image})
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    # nearest rank
+    rank = max(int(round(percent / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def print_report(title, latencies, errors, elapsed):
+    print(f"\n{title}")
+    print(f"{'endpoint':<20}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint in sorted(latencies):
+        values = sorted(latencies[endpoint])
+        print(
+            f"{endpoint:<20}{len(values):>10}{errors.get(endpoint, 0):>8}"
+            f"{len(values) / elapsed:>9.1f}"
+            f"{percentile(values, 50) * 1000:>9.1f}"
+            f"{percentile(values, 95) * 1000:>9.1f}"
+            f"{percentile(values, 99) * 1000:>9.1f}"
+        )
+    sys.stdout.flush()
+
+
+def parse_mix(mix):
+    result = {}
+    for item in mix.split(","):
+        endpoint, _, weight = item.partition("=")
+        endpoint = endpoint.strip()
+        if not hasattr(VirtualUser, f"do_{endpoint}"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {endpoint}")
+        result[endpoint] = float(weight or 1)
+
+    return result
+
+
+def start_app(port):
+    """
+    Starts the app in a background thread against a temporary SQLite database and chain storage
+    """
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(os.path.join(workdir, "storage", "chain_save_files"))
+    # the chain and image storage paths are relative to the working directory
+    os.chdir(workdir)
+
+    from werkzeug.serving import make_server
+    from app import app, db
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'load_test.db')}"
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"timeout": 30}}
+    with app.app_context():
+        db.create_all()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving app from {workdir} on 127.0.0.1:{port}")
+
+    return f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent virtual users against the API")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"endpoint weights, default {DEFAULT_MIX}")
+    parser.add_argument("--report-every", type=float, default=10, help="seconds between interim reports")
+    parser.add_argument("--port", type=int, default=5000,
+                        help="port for the in-process app, /list_transactions expects 5000")
+    parser.add_argument("--url", help="drive an already running node, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--seed", type=int, help="random seed for the endpoint mix")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    base_url = args.url.rstrip("/") if args.url else start_app(args.port)
+    recorder = Recorder()
+    addresses = []
+    deadline = time.monotonic() + args.duration
+
+    users = [VirtualUser(base_url, args.mix, recorder, addresses, deadline) for _ in range(args.users)]
+    for user in users:
+        user.start()
+
+    # interim reports show how latencies move as the chain grows
+    next_report = time.monotonic() + args.report_every
+    while any(user.is_alive() for user in users):
+        time.sleep(0.1)
+        if time.monotonic() < next_report:
+            continue
+
+        next_report += args.report_every
+        latencies, errors, elapsed = recorder.flush_window()
+        try:
+            transactions = requests.get(f"{base_url}/total_transactions", timeout=60).json()["result"]
+        except (requests.RequestException, ValueError, KeyError):
+            transactions = "?"
+        print_report(
+            f"[{time.perf_counter() - recorder.started:.0f}s] chain transactions: {transactions}",
+            latencies, errors, elapsed,
+        )
+
+    print_report(
+        f"Total over {time.perf_counter() - recorder.started:.0f}s with {args.users} users",
+        recorder.total, recorder.total_errors, time.perf_counter() - recorder.started,
+    )
+
+
+if __name__ == "__main__":
+    main()
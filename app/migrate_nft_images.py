@@ -0,0 +1,67 @@
+"""
+Moves NFT images out of the nft table into the content addressed image store.
+Run once after upgrading: python migrate_nft_images.py
+"""
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import app, db, image_store
+from models import NFT
+
+BATCH_SIZE = 100
+
+app.app_context().push()
+
+# the table name is case sensitive on postgres, quote it the way create_all did
+table = db.engine.dialect.identifier_preparer.quote(NFT.__table__.name)
+columns = {column["name"] for column in inspect(db.engine).get_columns(NFT.__table__.name)}
+
+if "image_digest" not in columns:
+    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN image_digest VARCHAR(64)"))
+if "image_type" not in columns:
+    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN image_type VARCHAR"))
+db.session.commit()
+
+if "image" in columns:
+    last_id = 0
+    while True:
+        # walk the table in id order so only one batch of images is in memory
+        rows = db.session.execute(
+            text(f"SELECT id, image FROM {table} WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            break
+
+        for nft_id, image in rows:
+            if image:
+                digest, mimetype = image_store.put(image)
+                db.session.execute(
+                    text(f"UPDATE {table} SET image_digest = :digest, image_type = :mimetype WHERE id = :id"),
+                    {"digest": digest, "mimetype": mimetype, "id": nft_id},
+                )
+            last_id = nft_id
+
+        db.session.commit()
+        print(f"Migrated images up to nft {last_id}")
+
+    db.session.execute(text(f"ALTER TABLE {table} DROP COLUMN image"))
+    db.session.commit()
+
+# the unique index is what stops two concurrent uploads of the same image from both being stored
+duplicates = db.session.execute(
+    text(f"SELECT image_digest FROM {table} WHERE image_digest IS NOT NULL GROUP BY image_digest HAVING COUNT(*) > 1")
+).fetchall()
+if duplicates:
+    sys.exit(
+        "Several nfts share an image, resolve them before running the migration again: "
+        + ", ".join(digest for digest, in duplicates)
+    )
+
+# replaces the plain index created by earlier runs of this migration
+db.session.execute(text("DROP INDEX IF EXISTS ix_nft_image_digest"))
+db.session.commit()
+for index in NFT.__table__.indexes:
+    index.drop(db.engine, checkfirst=True)
+    index.create(db.engine)
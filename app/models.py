@@ -1,9 +1,12 @@
 import base64
 
+from flask import url_for
 from flask_sqlalchemy import SQLAlchemy
 import secrets
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from blockchain import FAUCET_AMOUNT
+
 db = SQLAlchemy()
 
 
@@ -27,7 +30,7 @@ class User(db.Model):
             data = {
                 "sender": "0",
                 "receiver": address,
-                "amount": 100
+                "amount": FAUCET_AMOUNT
             }
             success, new_block = blockchain.new_transaction(data)
             if success and not new_block:
@@ -64,18 +67,23 @@ class User(db.Model):
 
 class NFT(db.Model):
     id = db.Column(db.Integer(), primary_key=True, autoincrement=True, unique=True, nullable=False)
-    image = db.Column(db.String())
+    image_digest = db.Column(db.String(64), index=True, unique=True)
+    image_type = db.Column(db.String())
     token = db.Column(db.String())
 
     def create_token(self):
         if self.token is None:
             self.token = f"0x{secrets.token_hex(32)}"
 
-    def to_json(self, blockchain):
+    def to_json(self, blockchain, owner=None):
+        image = None
+        if self.image_digest:
+            image = url_for("nft_image", digest=self.image_digest, _external=True)
+
         return {
-            "image": self.image,
+            "image": image,
             "token": self.token,
-            "owner": blockchain.get_owner(self.token)
+            "owner": owner or blockchain.get_owner(self.token)
         }
 
     def __repr__(self):
@@ -0,0 +1,149 @@
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request
+from flask_login import current_user
+
+PROFILED_BLOCKCHAIN_METHODS = ("build_block", "store_chain")
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads being profiled from a background thread
+    and aggregates them as collapsed stacks (the input format of flamegraph.pl / speedscope)
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        # thread ident -> label of the root frame
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def profile(self, label):
+        ident = threading.get_ident()
+        with self._lock:
+            # nested runs (e.g. build_block inside a profiled request) stay under the outer label
+            owner = ident not in self._tracked
+            if owner:
+                self._tracked[ident] = label
+                self._start()
+                self._wakeup.set()
+
+        try:
+            yield
+        finally:
+            if owner:
+                with self._lock:
+                    del self._tracked[ident]
+                    if not self._tracked:
+                        self._wakeup.clear()
+
+    def wrap(self, func, label):
+        @wraps(func)
+        def profiled(*args, **kwargs):
+            with self.profile(label):
+                return func(*args, **kwargs)
+
+        return profiled
+
+    def collapsed(self):
+        with self._lock:
+            stacks = list(self._stacks.items())
+
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks))
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            # sleeps for free while nothing is being profiled
+            self._wakeup.wait()
+            time.sleep(self.interval)
+
+            with self._lock:
+                tracked = dict(self._tracked)
+            if not tracked:
+                continue
+
+            frames = sys._current_frames()
+            collapsed = []
+            for ident, label in tracked.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    collapsed.append(self._collapse(label, frame))
+            del frames
+
+            with self._lock:
+                self._stacks.update(collapsed)
+                self.samples += len(collapsed)
+
+    @staticmethod
+    def _collapse(label, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.append(label)
+
+        return ";".join(name.replace(";", ":") for name in reversed(names))
+
+
+def init_profiling(app, blockchain):
+    """
+    Registers the profiling hooks when PROFILING_ENABLED is set, otherwise nothing is installed
+    :return: The SamplingProfiler or None when profiling is disabled
+    """
+    if not app.config.get("PROFILING_ENABLED"):
+        return None
+
+    profiler = SamplingProfiler(app.config.get("PROFILING_INTERVAL", 0.005))
+    sample_rate = app.config.get("PROFILING_SAMPLE_RATE", 0)
+    trigger_header = app.config.get("PROFILING_TRIGGER_HEADER")
+    trigger_token = app.config.get("PROFILING_TRIGGER_TOKEN")
+
+    def triggered():
+        value = request.headers.get(trigger_header) if trigger_header else None
+        if value is None:
+            return False
+
+        # anyone can send the header, only the token or an admin may start a profile
+        if trigger_token and hmac.compare_digest(value.encode("utf-8"), trigger_token.encode("utf-8")):
+            return True
+        return current_user.is_authenticated and current_user.admin
+
+    @app.before_request
+    def start_request_profile():
+        if triggered() or random.random() < sample_rate:
+            g.request_profile = profiler.profile(f"{request.method} {request.url_rule or request.path}")
+            g.request_profile.__enter__()
+
+    @app.teardown_request
+    def stop_request_profile(exc):
+        request_profile = g.pop("request_profile", None)
+        if request_profile is not None:
+            request_profile.__exit__(None, None, None)
+
+    for name in PROFILED_BLOCKCHAIN_METHODS:
+        setattr(blockchain, name, profiler.wrap(getattr(blockchain, name), name))
+
+    return profiler
@@ -0,0 +1,131 @@
+"""
+Creates many users at once: passwords are hashed in a thread pool, users are inserted in bulk
+and all faucet grants are packed into as few blocks as possible.
+Usage: python provisioning.py users.csv --workers 8 -o provisioned.json
+The csv needs an email and a password column.
+"""
+import argparse
+import csv
+import json
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from models import db, User
+
+EMAIL_QUERY_BATCH = 500
+
+# shared by every call, hashlib's pbkdf2 releases the GIL so threads hash in parallel
+# without forking the server process
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def get_hash_pool(workers=None):
+    """
+    :param workers: Size of the pool, only used by the call that creates it
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                            thread_name_prefix="password-hash")
+        return _hash_pool
+
+
+def hash_passwords(passwords, workers=None):
+    if len(passwords) < 2:
+        return [generate_password_hash(password) for password in passwords]
+
+    return list(get_hash_pool(workers).map(generate_password_hash, passwords))
+
+
+def existing_emails(emails):
+    found = set()
+    emails = list(emails)
+    for start in range(0, len(emails), EMAIL_QUERY_BATCH):
+        batch = emails[start:start + EMAIL_QUERY_BATCH]
+        found.update(email for email, in db.session.query(User.email).filter(User.email.in_(batch)))
+
+    return found
+
+
+def provision_users(blockchain, credentials, workers=None):
+    """
+    :param credentials: Iterable of (email, password)
+    :param workers: Number of threads used to hash passwords, None for one per cpu
+    :return: (created_users, skipped_emails)
+    """
+    accounts = {}
+    skipped = []
+    for email, password in credentials:
+        if not email or not password or email in accounts:
+            skipped.append(email)
+            continue
+        accounts[email] = password
+
+    for email in existing_emails(accounts):
+        del accounts[email]
+        skipped.append(email)
+
+    if not accounts:
+        return [], skipped
+
+    emails = list(accounts)
+    hashes = hash_passwords([accounts[email] for email in emails], workers)
+
+    users = []
+    for email, password_hash in zip(emails, hashes):
+        user = User(email=email, password=password_hash, address=f"0x{secrets.token_hex(32)}")
+        user.set_api_key()
+        users.append(user)
+
+    # users are committed before their grants are mined, so a failed insert never leaves
+    # coins on chain for users that do not exist
+    while users:
+        try:
+            db.session.bulk_save_objects(users)
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            # a signup raced past existing_emails, drop those and retry
+            taken = existing_emails(user.email for user in users)
+            if not taken:
+                raise
+            users = [user for user in users if user.email not in taken]
+            skipped.extend(taken)
+
+    if users:
+        blockchain.grant_faucet(user.address for user in users)
+
+    return users, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create users in bulk")
+    parser.add_argument("csv_file", help="csv file with email and password columns")
+    parser.add_argument("--workers", type=int, default=None, help="password hashing threads")
+    parser.add_argument("-o", "--output", help="write the created users (with api keys) to this json file")
+    args = parser.parse_args()
+
+    from app import app, current_blockchain
+
+    with open(args.csv_file, newline="") as f:
+        credentials = [(row.get("email"), row.get("password")) for row in csv.DictReader(f)]
+
+    with app.app_context():
+        users, skipped = provision_users(current_blockchain, credentials, args.workers)
+        print(f"Created {len(users)} users, skipped {len(skipped)}")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump([user.to_json() for user in users], f)
+
+
+if __name__ == "__main__":
+    main()